@@ -1,11 +1,33 @@
-from functools import cache
-from PIL import Image
+from functools import cache, lru_cache
 import argparse, os, json, pandas
 from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
+import rdkit
 from rdkit import Chem
 from rdkit.Chem import AllChem, Draw, Descriptors, rdFreeSASA
 from mhp.smiles import monomer_dict, init_dict, checkAndMergeSMILESDicts
+from mhp.settings import default_dict as built_in_settings #single source for default values used in signatures below.
+try: #faster json parsing if available. The standard library is used otherwise.
+    import orjson
+except ImportError:
+    orjson = None
+try: #optional on-disk cache of optimized conformers that is shared between runs of the program.
+    from joblib import Memory
+except ImportError:
+    Memory = None
+#bump this whenever optPol changes how conformers are made so old entries in the disk cache are not reused.
+OPT_CACHE_VERSION = 1
+#the disk cache is trimmed to this size (least recently used entries are removed first).
+DISK_CACHE_BYTES_LIMIT = "500M"
+
+@lru_cache(maxsize=1024) #the same smiles (end groups, repeat units, polymers) get parsed by several steps of a run.
+def _cachedMolFromSmiles(smi):
+    return Chem.MolFromSmiles(smi)
+
+def molFromSmiles(smi):
+    #returns a copy so callers that change the mol (labels, RWMol edits) cannot change the cached one.
+    mol = _cachedMolFromSmiles(smi)
+    return Chem.Mol(mol) if mol is not None else None
 
 class Polymer:
     """
@@ -14,19 +36,19 @@ class Polymer:
     smiles: str, smiles string
     mpn: int, the number of monomers in a comonomer sequence
     flat: mol, 2D structure. Used for pictures
-    suppl: SDMolsuppl, the itterator with the conformers
+    suppl: list, a mol for each conformer
     ratio: str, the ratio of monomers in a polymer with random monomer ordering using a target ratio
     """
-    def __init__(self, n, smiles, mpn=1, ratio=None, suppl=None):
+    def __init__(self, n, smiles, mpn=1, ratio=None, suppl=None, flat=None):
         self.n = n
         self.mpn = mpn
         self.smiles = smiles
-        self.flat = self.get2D()
+        self.flat = flat if flat is not None else self.get2D() #skip parsing the smiles again if the mol was already built.
         self.suppl = suppl
         self.ratio = ratio
     
     def get2D(self):
-        return Chem.MolFromSmiles(self.smiles)
+        return molFromSmiles(self.smiles)
 
 def getStaticSettings():
     """
@@ -35,9 +57,9 @@ def getStaticSettings():
     if os.path.exists("mhpSettings.json"):
         from mhp.settings import readJson
         print("NOTICE: found mhpSettings.json. This takes presedence over the built-in settings.")
-        settings_dict = readJson("mhpSettings.json")
+        settings_dict = {**built_in_settings, **readJson("mhpSettings.json")} #settings missing from older files fall back to the defaults.
     else:
-        from mhp.settings import default_dict as settings_dict
+        settings_dict = built_in_settings
 
     return settings_dict
 
@@ -45,38 +67,40 @@ def getJsonArgs(jsonFile, dict):
     """
     Reads run parameters from a file. Allows multiple jobs to be run sequentially with one command.
     """
-    with open(jsonFile, 'r') as J: #open json file
-        runs_dict = json.load(J) #read it
-        for run in runs_dict["runs"]: #so few items the nested for loops shouldn't be a big deal
-            run_keys = run.keys()
-            for dict_key in dict.keys(): #the keys submitted to the func (derrived from CLI arguments)
-                if dict_key not in run_keys: #if there is a key provided by user not in the dict derrived from the json file
-                    run[dict_key] = dict[dict_key] #then add it
-    run_list = runs_dict["runs"] #now we have a list of runs with all arguments from file and command line.
+    with open(jsonFile, 'rb') as J: #open json file
+        raw = J.read() #read it
+    runs_dict = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    #keys submitted to the func (derrived from CLI arguments) fill in anything a run does not specify.
+    run_list = [{**dict, **run} for run in runs_dict["runs"]] #now we have a list of runs with all arguments from file and command line.
     return run_list
 
+#commandline arguments. Built once when the module is imported and reused by every call to getArgs.
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", type = int, default = 0, help = "The number of monomer or comonomer sequences to repeat.")
+parser.add_argument("-i", "--initiator", type = str, default = "Hydrogen", help = "Initiator Key from initiator dict or SMILES. Defaults to Hydrogen.")
+parser.add_argument("-t", "--terminator", type = str, default = "Hydrogen", help = "Terminator key taken from initiator dict or SMILES. Defaults to Hydrogen.")
+parser.add_argument("-m","--single_monomer", type = str, help = "Monomer key from the included monomer dict. See the -s flag for specifying a monomer that is not included.")
+parser.add_argument("-b", "--comonomer_sequence", type = str, nargs = '*',
+                    help = "A series of space-separated monomer SMILES arranged in their repeating sequence. You can add an int preceeding any monomer to represent multiple copies of that monomer. e.g. 2 A B means AAB is the repeating super-monomer. Use quotes surrounding SMILES with problematic characters like = or ()")
+parser.add_argument("-d", "--draw", type = str, help = "Filename for polymer image.")
+parser.add_argument("-v", "--verbose", default = False, action = "store_true", help = "Set increased verbosity. Will draw polymer to polymer.png unless alternate name set by -d option.")
+parser.add_argument("-c","--calculation", type = str, nargs = '*', 
+                    help = "Type of calculation(s) to be performed input as a space-separated list. Options are LogP, SA (surface area), MV (Molecular Volume), MHP (Mathers Hydrophobicity Parameter (LogP/SA; each of which will also be reported. Use XMHP to exclude those plots)) and Rg (radius of gyration).")
+parser.add_argument("-s","--save", type = str, help = "The name/path of the file you wish to save the mol to. Supported formats are .pdb, .xyz and .mol")
+parser.add_argument("-r", "--read", type = str, help = "The name/path to file you wish to import. Supported formats are .pdb, .mol and .sdf")
+parser.add_argument("-p", "--plot", default = False, action = "store_true", 
+                    help = "Include this option to generate a plot of whatever calculations are specified with -c on polymers from 1 to the n specified with the -n flag. This means the molecule cannot be read from a file with the -r flag. If used with the -f flag multiple files will be saved with names based off the one provided.")
+parser.add_argument("-e", "--export", type = str, help = "Include this option to export a .csv file of all data calculations. Specify the name here. Names ending in .jsonl are exported as JSON Lines instead.")
+parser.add_argument("-j", "--json", type = str, help = "The path to a compatible .json file with any of the above arguments.")
+parser.add_argument("-q", "--quiet", default = False, action = "store_true", help = "Add this option to suppress the confirmation step which by default prevents calculations from running until the structure of the polymer is approved.")
+parser.add_argument("-a", "--random", default = False, action = "store_true",
+        help="Requires the use of the -b flag. Interprets coefficients as desired relative amounts of each comonomer. The ratio provided will be scaled to fit the desired number of monomers. The ordering will be randomized.")
+parser.add_argument("-C", "--num_confs", type = int, help = "The number of conformations to generate. Overrides opt_numConfs from the settings for this run.")
+parser.add_argument("--mmff_iters", type = int, help = "The maximum number of iterations used in optimization. Overrides opt_maxIters from the settings for this run.")
+parser.add_argument("--no_cache", default = False, action = "store_true", help = "Do not read or write optimized conformers in the on-disk cache (~/.cache/mhp, requires joblib) for this run.")
+
 def getArgs():
     #get commandline arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-n", type = int, default = 0, help = "The number of monomer or comonomer sequences to repeat.")
-    parser.add_argument("-i", "--initiator", type = str, default = "Hydrogen", help = "Initiator Key from initiator dict or SMILES. Defaults to Hydrogen.")
-    parser.add_argument("-t", "--terminator", type = str, default = "Hydrogen", help = "Terminator key taken from initiator dict or SMILES. Defaults to Hydrogen.")
-    parser.add_argument("-m","--single_monomer", type = str, help = "Monomer key from the included monomer dict. See the -s flag for specifying a monomer that is not included.")
-    parser.add_argument("-b", "--comonomer_sequence", type = str, nargs = '*',
-                        help = "A series of space-separated monomer SMILES arranged in their repeating sequence. You can add an int preceeding any monomer to represent multiple copies of that monomer. e.g. 2 A B means AAB is the repeating super-monomer. Use quotes surrounding SMILES with problematic characters like = or ()")
-    parser.add_argument("-d", "--draw", type = str, help = "Filename for polymer image.")
-    parser.add_argument("-v", "--verbose", default = False, action = "store_true", help = "Set increased verbosity. Will draw polymer to polymer.png unless alternate name set by -d option.")
-    parser.add_argument("-c","--calculation", type = str, nargs = '*', 
-                        help = "Type of calculation(s) to be performed input as a space-separated list. Options are LogP, SA (surface area), MV (Molecular Volume), MHP (Mathers Hydrophobicity Parameter (LogP/SA; each of which will also be reported. Use XMHP to exclude those plots)) and Rg (radius of gyration).")
-    parser.add_argument("-s","--save", type = str, help = "The name/path of the file you wish to save the mol to. Supported formats are .pdb, .xyz and .mol")
-    parser.add_argument("-r", "--read", type = str, help = "The name/path to file you wish to import. Supported formats are .pdb, .mol and .sdf")
-    parser.add_argument("-p", "--plot", default = False, action = "store_true", 
-                        help = "Include this option to generate a plot of whatever calculations are specified with -c on polymers from 1 to the n specified with the -n flag. This means the molecule cannot be read from a file with the -r flag. If used with the -f flag multiple files will be saved with names based off the one provided.")
-    parser.add_argument("-e", "--export", type = str, help = "Include this option to export a .csv file of all data calculations. Specify the name here.")
-    parser.add_argument("-j", "--json", type = str, help = "The path to a compatible .json file with any of the above arguments.")
-    parser.add_argument("-q", "--quiet", default = False, action = "store_true", help = "Add this option to suppress the confirmation step which by default prevents calculations from running until the structure of the polymer is approved.")
-    parser.add_argument("-a", "--random", default = False, action = "store_true",
-            help="Requires the use of the -b flag. Interprets coefficients as desired relative amounts of each comonomer. The ratio provided will be scaled to fit the desired number of monomers. The ordering will be randomized.")
     args, _ = parser.parse_known_args() #second result is for unknown arguments
     #get additional arguments from json file if provided or by default if no args provided.
     vardict = vars(args)
@@ -92,7 +116,7 @@ def getRepeatUnit(single, co):
     if single is not None and co is not None:
         raise TypeError("Cannot specify both single and comonomers")
     #This gives a list of components of a comonomer block or just the string used for single monomer in dict
-    repeat_unit = list(filter(None, [single, co]))[0]
+    repeat_unit = single if single is not None else co
     return repeat_unit
 
 def parse_smiles_dict_keys(compound_list, compound_dict):
@@ -123,7 +147,7 @@ def validate_end_group(inator, *, Init=False, Term=False, verbosity=False):
     if inator != "" and inator[idx] == "*": #the attatchment point does not face the rest of polymer
         if verbosity:
             print("initiator smiles in wrong direction. Converting to mol object.")
-        inator = Chem.MolFromSmiles(inator)
+        inator = molFromSmiles(inator)
     elif inator != inator[::-1] and "*" not in inator:
         raise ValueError("end group smiles is not palendromic yet has no attatchment point specified.")
     else:
@@ -134,7 +158,7 @@ def validate_end_group(inator, *, Init=False, Term=False, verbosity=False):
 def get_building_blocks(i,t,m,*, verbosity = False):
     init, term = inator_smi_lookup(i, t) #converts end groups to mol objects if not right direction for text addition.
     
-    if type(m) == list:
+    if isinstance(m, list):
         #replace any dict keys with corresponding smiles.
         deciphered_dict_keys = parse_smiles_dict_keys(m, mono)
         
@@ -144,16 +168,17 @@ def get_building_blocks(i,t,m,*, verbosity = False):
         sum_implicit_coefs = len(deciphered_dict_keys) - sum(explicit_coefs) #number of implicit coefs of 1.
         monomers_per_n = sum(explicit_coefs) + sum_implicit_coefs #total monomer unit count per super-monomer.
 
-        #start with empty repeat unit and concatonate stuff we find in the list.
-        repeat_unit = ""
+        #collect the pieces we find in the list and join them once at the end.
+        repeat_parts = []
         #ommission of a coeficient implies 1 copy
         repeat_coef = 1
         for element in deciphered_dict_keys:
             try:
                 repeat_coef = int(element) #is this a string of an integer?
-            except:
-                repeat_unit += repeat_coef * element #if not, repeat the SMILES as many times as specified (or once if no coef. provided).
+            except ValueError:
+                repeat_parts.append(repeat_coef * element) #if not, repeat the SMILES as many times as specified (or once if no coef. provided).
                 repeat_coef = 1 #reset coef.
+        repeat_unit = "".join(repeat_parts)
     else:
         repeat_unit = monomer_smi_lookup(m) #if not a list, look for the corresponding smiles in the dictionary, will throw error if not included.
         monomers_per_n = 1
@@ -164,66 +189,46 @@ def get_building_blocks(i,t,m,*, verbosity = False):
     return init, term, repeat_unit, monomers_per_n
 
 def attatch_frags(polymer_smiles, *, add_initiator = (False, None), add_terminator = (False, None)): #the initiator and terminator are the kwargs
-    pol = Chem.MolFromSmiles(polymer_smiles)
+    pol = molFromSmiles(polymer_smiles)
     #get indicies of fake atoms ("*")
     fake_atoms = [a.GetIdx() for a in pol.GetAtoms() if a.GetAtomicNum() == 0]
     #and their neighbors (to which we will actually be attatching.)
     conn_atoms = [pol.GetAtomWithIdx(x).GetNeighbors()[0].GetIdx() for x in fake_atoms]
 
-    #lable the head and tail, accounting for possible absense of one or both inators.
+    #pair each end group with the index of the polymer atom it bonds to (head or tail), accounting for possible absense of one or both inators.
     inators = []
     if add_initiator[0]:
-        head = pol.GetAtomWithIdx(conn_atoms[0])
-        head.SetProp("atomNote", "head")
-        inators.append(add_initiator[1])
+        inators.append((add_initiator[1], conn_atoms[0])) #head
         if add_terminator[0]:
-            tail = pol.GetAtomWithIdx(conn_atoms[1]) #note index
-            tail.SetProp("atomNote", "tail")
-            inators.append(add_terminator[1])
+            inators.append((add_terminator[1], conn_atoms[1])) #tail
     elif add_terminator[0]:
-        tail = pol.GetAtomWithIdx(conn_atoms[0]) #note index
-        tail.SetProp("atomNote", "tail")
-        inators.append(add_terminator[1])
+        inators.append((add_terminator[1], conn_atoms[0])) #tail
     else:
         raise Exception(f"Unknown combination of inators {add_initiator = }, {add_terminator = }.")
 
-    #set name to what will be used after one loop completes.
-    mergedrw = pol
-    for inator in inators:
-        #see above.
-        fake_atoms = [a.GetIdx() for a in inator.GetAtoms() if a.GetAtomicNum() == 0]
-        #this time we just isolate atom object instead of index.
-        attatch = [inator.GetAtomWithIdx(x).GetNeighbors()[0] for x in fake_atoms][0]
-        #lable.
-        attatch.SetProp("atomNote", "attatch")
-        #put the two mols into the same object (still no bond between them.)
-        merged = Chem.CombineMols(inator, mergedrw)
-        #change to rwmol object which can be changed.
-        mergedrw = Chem.RWMol(merged)
-
-        #indicies of atoms with notes
-        attachments = [a.GetIdx() for a in mergedrw.GetAtoms() if a.HasProp('atomNote')]
-        #isolating proper index from list to use in bond formation.
-        inator_attatchment = [i for i in attachments if mergedrw.GetAtomWithIdx(i).GetProp('atomNote') == "attatch"][0]
-
-        if inator == add_initiator[1]: #inator changes with each pass through the loop
-            bond_here = [i for i in attachments if mergedrw.GetAtomWithIdx(i).GetProp('atomNote') == "head"][0]
-
-        if inator == add_terminator[1]:
-            bond_here = [i for i in attachments if mergedrw.GetAtomWithIdx(i).GetProp('atomNote') == "tail"][0]
-            
+    merged = pol
+    bonds = []
+    for inator, bond_here in inators:
+        #see above. We only need the first fake atom.
+        fake_atom = [a.GetIdx() for a in inator.GetAtoms() if a.GetAtomicNum() == 0][0]
+        attatch = inator.GetAtomWithIdx(fake_atom).GetNeighbors()[0].GetIdx()
+        #the end group's atoms are added after the atoms already merged, so its indicies are shifted by that many atoms.
+        bonds.append((bond_here, merged.GetNumAtoms() + attatch))
+        #put the mols into the same object (still no bond between them.)
+        merged = Chem.CombineMols(merged, inator)
+
+    #change to rwmol object which can be changed. Done once for both end groups.
+    mergedrw = Chem.RWMol(merged)
+    for bond_here, inator_attatchment in bonds:
         #make bond
         mergedrw.AddBond(bond_here, inator_attatchment, Chem.rdchem.BondType.SINGLE)
-        #change label so that atom is not targeted a second time for bond formation.
-        mergedrw.GetAtomWithIdx(inator_attatchment).ClearProp('atomNote')
 
-    #count up number of dummy atoms ("*")
-    dummies = [a for a in mergedrw.GetAtoms() if a.GetAtomicNum() == 0]
-    numDummies = len(dummies)
+    #indicies of dummy atoms ("*"), largest first so removing one does not shift the ones left to remove.
+    dummies = sorted([a.GetIdx() for a in mergedrw.GetAtoms() if a.GetAtomicNum() == 0], reverse=True)
 
-    #remove the dummy atoms (need to do one at a time because index changes each time).
-    for _ in range(numDummies):
-        mergedrw.RemoveAtom([a.GetIdx() for a in mergedrw.GetAtoms() if a.GetAtomicNum() == 0][0])
+    #remove the dummy atoms.
+    for idx in dummies:
+        mergedrw.RemoveAtom(idx)
 
     smi = Chem.MolToSmiles(mergedrw)
     return smi
@@ -233,7 +238,7 @@ def add_inator_smiles(smi, init, term, *, verbosity=False):
     if verbosity:
         print(f"polymer smiles is {smi} before any end groups")
 
-    if type(init) != str: #i.e. a mol object instead
+    if not isinstance(init, str): #i.e. a mol object instead
         smi = "*" + smi
         add_initiator = True # we will attatch with mol-based methods
     else:
@@ -242,7 +247,7 @@ def add_inator_smiles(smi, init, term, *, verbosity=False):
         if verbosity and init != "":
             print(f"polymer smiles is {smi} after adding initiator smiles")
             
-    if type(term) != str: #i.e. a mol object instead
+    if not isinstance(term, str): #i.e. a mol object instead
         smi = smi + "*" #same as above but for terminator. Attachment point is at end this time.
         add_terminator = True
     else:
@@ -287,14 +292,21 @@ def createPolymerObj(i,n,r,t,*, verbosity = False, test = False):
     else:
         return POL
    
-def optPol(FLAT, name=None, nConfs=5, threads=0, iters=1500): #name is provided my supplemental scripts.
+def optPol(FLAT, name=None, nConfs=built_in_settings["opt_numConfs"], threads=built_in_settings["opt_numThreads"], iters=built_in_settings["opt_maxIters"],
+        seed=built_in_settings["opt_randomSeed"], pruneRms=built_in_settings["opt_pruneRmsThresh"]): #name is provided my supplemental scripts.
     #optimizes the Polymer and uses only the conformers that converged
     #check mol
     Chem.SanitizeMol(FLAT)
     #opt steps
     pol_h = Chem.AddHs(FLAT)
-    #random coords lead to better geometries than using the rules rdkit has. Excluding this kwarg leads to polymers that do not fold properly.
-    ids = AllChem.EmbedMultipleConfs(pol_h, numConfs=nConfs, useRandomCoords=True, numThreads=threads) #get multiple conformers for better stats 
+    ps = AllChem.ETKDGv3()
+    #random coords lead to better geometries than using the rules rdkit has. Excluding this leads to polymers that do not fold properly.
+    ps.useRandomCoords = True
+    ps.useSmallRingTorsions = True
+    ps.numThreads = threads
+    ps.randomSeed = seed #fixed seed makes runs reproducible. -1 gives a random seed.
+    ps.pruneRmsThresh = pruneRms #drop near-duplicate conformers before the expensive optimization. -1 keeps all of them.
+    ids = AllChem.EmbedMultipleConfs(pol_h, numConfs=nConfs, params=ps) #get multiple conformers for better stats 
     touple_list = AllChem.MMFFOptimizeMoleculeConfs(pol_h, numThreads=threads, maxIters=iters) #rdkit default 200 iterations.
     for i, tup in enumerate(touple_list):
         if tup[0] == 1: #not converged
@@ -302,47 +314,83 @@ def optPol(FLAT, name=None, nConfs=5, threads=0, iters=1500): #name is provided
     if pol_h.GetNumConformers() == 0: #all conformations have failed to converge. Tell the user to change something.
         raise Exception("Optimization failed to converge. Increase maxIters valve in mhpSettings.json and rereun.")
     
-    #calculations are inconsistent if using conf ids instead of just single-conf mols. Translate to sdf mol supplier to make it easy to integrate with reading files.
-    if name is None:
-        i = 0
-        while os.path.exists(f"tmp_{i}.sdf"): #this is a band-aid solution for the fact that on windows anaconda prompts the temporary files cannot be removed
-            i += 1            
-        sdfFilename = f"tmp_{i}.sdf"
-    else:
+    #calculations are inconsistent if using conf ids instead of just single-conf mols. Split into one mol per conformer so it is easy to integrate with reading files.
+    #Hs are removed to match what reading the conformers back from an sdf file gives.
+    suppl = []
+    for conf in pol_h.GetConformers():
+        cid = conf.GetId() #The conf ids may not be sequential.
+        conf_mol = Chem.RemoveHs(Chem.Mol(pol_h, confId=cid))
+        conf_mol.SetProp('_Name', f'conformer_{cid}') #same title the sdf reader gave each conf, so saved .sdf files are unchanged.
+        suppl.append(conf_mol)
+
+    if name is not None: #supplemental scripts want the conformers saved.
         ext = name.split(".")[1]
         if ext != "sdf":
             raise Exception("Filename must use .sdf format.")
-        sdfFilename = name
-    writer = Chem.SDWriter(sdfFilename)
-    for conf in pol_h.GetConformers(): #loop through all conformers that still exist. We only write the conformations that converged.
-        cid = conf.GetId() #The numbers may not be sequential.
-        pol_h.SetProp('_Name', f'conformer_{cid}') #when sdf is read each conf is separate mol object.
-        # pol_h.SetProp('ID', f'conformer_{cid}') #Similar method can be used to print number of monomers for plot jobs.
-        writer.write(pol_h, confId=cid) #save the particular conf to the file.  
-    writer.flush() #if this isn't included some (small) monomers break everything.
-    writer.close()
-    suppl = Chem.SDMolSupplier(sdfFilename) #iterator that has all mols in the sdf file.
-    
-    if name is None:
-        try:
-            os.remove(sdfFilename) #cleanup if this is meant to be a temporary file.
-        except: #this fails on Windows, but not Linux
-            print("failed to remove tmp file.")
+        writer = Chem.SDWriter(name)
+        for conf in pol_h.GetConformers(): #loop through all conformers that still exist. We only write the conformations that converged.
+            cid = conf.GetId() #The numbers may not be sequential.
+            pol_h.SetProp('_Name', f'conformer_{cid}') #when sdf is read each conf is separate mol object.
+            # pol_h.SetProp('ID', f'conformer_{cid}') #Similar method can be used to print number of monomers for plot jobs.
+            writer.write(pol_h, confId=cid) #save the particular conf to the file.  
+        writer.flush() #if this isn't included some (small) monomers break everything.
+        writer.close()
             
-    return suppl #suppl now has each conformation as a separate mol obj when we iterate thru it.
-
-def confirmStructure(smi, *, proceed=None):
+    return suppl #suppl has each conformation as a separate mol obj when we iterate thru it.
+
+def _optPolMolBlocks(smiles, nConfs, threads, iters, seed, pruneRms, version):
+    #mol blocks are small to store and quick to read back compared to embedding and optimizing again.
+    #version is only part of the cache key. threads is left out of the key since it does not change the result with a fixed seed.
+    return [Chem.MolToMolBlock(mol) for mol in optPol(molFromSmiles(smiles), nConfs=nConfs, threads=threads, iters=iters, seed=seed, pruneRms=pruneRms)]
+
+@cache #only create the cache directory the first time it is used.
+def getDiskCache():
+    if Memory is None: #joblib is not installed.
+        return None
+    location = os.path.join(os.path.expanduser("~"), ".cache", "mhp") #delete this directory to clear the cache.
+    memory = Memory(location, verbose=0)
+    try:
+        memory.reduce_size(bytes_limit=DISK_CACHE_BYTES_LIMIT)
+    except TypeError: #joblib < 1.3 takes the limit when the cache is created instead.
+        memory = Memory(location, bytes_limit=DISK_CACHE_BYTES_LIMIT, verbose=0)
+        memory.reduce_size()
+    return memory.cache(_optPolMolBlocks, ignore=["threads"])
+
+@lru_cache(maxsize=256) #embedding and optimizing is by far the slowest step. Reuse the conformers if the same polymer is requested again (e.g. json runs).
+def _optPolMemo(smiles, nConfs, threads, iters, seed, pruneRms, disk):
+    #with joblib installed the conformers are also kept on disk for later runs.
+    diskCached = getDiskCache() if disk else None
+    if diskCached is not None:
+        #key on the canonical smiles so equivalent inputs written differently share one disk entry.
+        canonical = Chem.MolToSmiles(molFromSmiles(smiles))
+        return tuple(Chem.MolFromMolBlock(block) for block in diskCached(canonical, nConfs, threads, iters, seed, pruneRms, f"{OPT_CACHE_VERSION}-{rdkit.__version__}"))
+    #tuple so the shared container cannot be changed. The mols inside are shared too, so callers get copies from optPolFromSettings.
+    return tuple(optPol(molFromSmiles(smiles), nConfs=nConfs, threads=threads, iters=iters, seed=seed, pruneRms=pruneRms))
+
+def optPolCached(smiles, nConfs=built_in_settings["opt_numConfs"], threads=built_in_settings["opt_numThreads"], iters=built_in_settings["opt_maxIters"],
+        seed=built_in_settings["opt_randomSeed"], pruneRms=built_in_settings["opt_pruneRmsThresh"], disk=built_in_settings["opt_diskCache"]):
+    if seed == -1: #a random seed is supposed to give new conformers each time, so it is never cached.
+        return tuple(optPol(molFromSmiles(smiles), nConfs=nConfs, threads=threads, iters=iters, seed=seed, pruneRms=pruneRms))
+    return _optPolMemo(smiles, nConfs, threads, iters, seed, pruneRms, disk)
+
+def optPolFromSettings(smiles, defaults, needs_3d=True):
+    #optimize with the parameters from the settings so every caller does it the same way.
+    if not needs_3d: #nothing requested needs coordinates (e.g. only LogP), so skip embedding and optimization entirely.
+        return [molFromSmiles(smiles)]
+    confs = optPolCached(smiles, nConfs=defaults["opt_numConfs"], threads=defaults["opt_numThreads"], iters=defaults["opt_maxIters"],
+        seed=defaults["opt_randomSeed"], pruneRms=defaults["opt_pruneRmsThresh"], disk=defaults["opt_diskCache"])
+    #copy each mol so calculations that set properties on it (e.g. CalcSASA) do not leak into later runs using the cached conformers.
+    return [Chem.Mol(mol) for mol in confs]
+
+def confirmStructure(smi, *, mol=None, proceed=None):
     #shows the user an image of the repeat unit with attached end groups
-    #save image to temporary file
-    drawPol(Chem.MolFromSmiles(smi), "tmp_confirm.png")
-    img = Image.open("tmp_confirm.png")
-    #show it to user
+    #only parse the smiles if the mol was not already built.
+    if mol is None:
+        mol = molFromSmiles(smi)
+    #draw the image in memory and show it to user
+    img = Chem.Draw.MolToImage(mol)
     img.show()
     inp = input("Does this look right? [Y/n]")
-    
-    if os.path.exists("tmp_confirm.png"):
-        os.remove("tmp_confirm.png")
-        #delete the file
 
     #affirmation is y, Y or just hitting enter
     if inp.lower() == "y" or inp == "":
@@ -357,7 +405,7 @@ def confirmStructure(smi, *, proceed=None):
     if proceed is not None:
         return inp #used to stop plotting jobs from asking for confirmation for each pol those jobs generate.
 
-def make_One_or_More_Polymers(i, n, r, t, *, verbosity=False, plot=False, confirm=False, defaults={"opt_numConfs":5, "opt_numThreads":0, "opt_maxIters":1500}):
+def make_One_or_More_Polymers(i, n, r, t, *, verbosity=False, plot=False, confirm=False, needs_3d=True, defaults=built_in_settings):
     # Makes polymers specified by user.
     POL_LIST = []
     if i == "Hydrogen" and t == "Hydrogen":
@@ -394,7 +442,7 @@ def make_One_or_More_Polymers(i, n, r, t, *, verbosity=False, plot=False, confir
             if verbosity:        
                 print(f"Converting n={n-j} to RDkit mol now.")
             #get opt and unopt molecules.
-            POL.suppl = optPol(POL.flat, nConfs=defaults["opt_numConfs"], threads=defaults["opt_numThreads"], iters=defaults["opt_maxIters"])
+            POL.suppl = optPolFromSettings(POL.smiles, defaults, needs_3d=needs_3d)
         return POL_LIST
     else: #just one polymer.
         test_smi, POL = createPolymerObj(i, n, r, t, verbosity=verbosity, test=True)
@@ -406,12 +454,12 @@ def make_One_or_More_Polymers(i, n, r, t, *, verbosity=False, plot=False, confir
             print("Showing structure with n=1 to confirm correct end groups")
             confirmStructure(test_smi)
 
-        POL.suppl = optPol(POL.flat, nConfs=defaults["opt_numConfs"], threads=defaults["opt_numThreads"], iters=defaults["opt_maxIters"]) #both are mol objects
+        POL.suppl = optPolFromSettings(POL.smiles, defaults, needs_3d=needs_3d) #both are mol objects
         return POL
 
 def drawPol(pol, drawName, image_size=250):
     #draws the 2d version of the polymer to an image
-    if type(pol) == list: #save a grid image instead using the polymers in the list
+    if isinstance(pol, list): #save a grid image instead using the polymers in the list
         img = Chem.Draw.MolsToGridImage([POL.flat for POL in pol], legends = [f"n = {(i + 1) * pol[i].mpn}" for i in range(len(pol))], subImgSize=(image_size, image_size))
         #mpn is the number of monomers per "n". This is > 1 when -s is used and multiple monomers or copies of the same monomer are specified.
         img.save(drawName)
@@ -434,28 +482,25 @@ def write_or_read_pol(name, n=None, verbosity=False, read=False, suppl=None):
             elif ext == "mol":
                 pol_h = Chem.MolFromMolFile(name)
             elif ext == "sdf":
-                suppl = Chem.SDMolSupplier(name)
-                for pol in suppl: #grab one conf so we can visualize
-                    pol_h = pol
-                    break #we break the loop since only one conf is needed to visualize
+                suppl = [pol for pol in Chem.SDMolSupplier(name)] #read every conf once instead of reparsing the file for each calculation.
+                pol_h = suppl[0] #grab one conf so we can visualize
             else:
                 print(f"unsuported extention: {ext} in {name} Please use .pdb, .mol or .sdf") #.xyz cannot be read by rdkit.
                 quit()
 
             if suppl is None:
-                sdf_name = "tmp.sdf"
-                writer = Chem.SDWriter(sdf_name)
-                writer.write(pol_h)
-                suppl = Chem.SDMolSupplier(sdf_name) #iterator that has all mols in the sdf file.
-                writer.flush() #if this isn't included some (small) monomers break everything.
-                writer.close()  
-                os.remove(sdf_name)
-
-            #convert to smiles so it can be visualized
+                #rebuild from a mol block. This is NOT redundant: mols from pdb files keep their residue info, which makes
+                #rdFreeSASA.classifyAtoms return no radii and CalcSASA crash. The mol block keeps coords but drops residue info.
+                pol_h = Chem.MolFromMolBlock(Chem.MolToMolBlock(pol_h))
+                suppl = [pol_h] #calculations expect an iterable of confs.
+
+            #topology-only copy so it can be visualized without reparsing the smiles
+            flat = Chem.Mol(pol_h)
+            flat.RemoveAllConformers()
             polSMILES = Chem.MolToSmiles(pol_h)
             if verbosity:
                 print(f"polymer smiles is: {polSMILES}")
-            POL = Polymer(n, polSMILES, mpn=1, suppl=suppl)
+            POL = Polymer(n, polSMILES, mpn=1, suppl=suppl, flat=flat)
             return POL
         else:
             raise FileNotFoundError(name)
@@ -464,26 +509,18 @@ def write_or_read_pol(name, n=None, verbosity=False, read=False, suppl=None):
             print(f'writing molecule to {name}')
 
         #what are we dealing with?
-        if type(suppl) == type(Chem.SDMolSupplier()):
-            for pol in suppl:
-                first_conf = pol
-                cid = -1
-                break #we will only be writing the first conf in the iterable for non-sdf files.
+        if isinstance(suppl, list):
+            first_conf = suppl[0] #we will only be writing the first conf in the list for non-sdf files.
+            cid = -1
         else:
-            raise TypeError("suppl must be an SDMollSupplier")
+            raise TypeError("suppl must be a list of conformers")
 
         #is the file type valid?
         if ext == "sdf":
             writer = Chem.SDWriter(name)
-            if suppl:
-                for pol in suppl:
-                  writer.write(pol)
-            else: #is a mol opject        
-                for conf in suppl.GetConformers(): #loop through all conformers that still exist. We only write the conformations that converged.
-                    cid = conf.GetId() #The numbers may not be sequential.
-                    suppl.SetProp('_Name', f'conformer_{cid}') #when sdf is read each conf is separate mol object.
-                    # mol.SetProp('ID', f'conformer_{cid}') #Similar method can be used to print number of monomers for plot jobs.
-                    writer.write(suppl, confId=cid)
+            for pol in suppl:
+                writer.write(pol)
+            writer.close()
         
         elif ext == "xyz":
             Chem.MolToXYZFile(first_conf, name, confId = cid)
@@ -539,46 +576,45 @@ def func_exp(x, a, b, c):
     #c = 0
     return a * (x**b) + c
 
-def doCalcs(pol_iter, calcs, defaults={"MV_gridSpacing":0.2, "MV_boxMargin" :2.0}):
+def getCalcFlags(calculations):
+    #converts the requested calculations to booleans once so each polymer only has to check flags.
+    calcs = set([calc.upper() for calc in calculations]) #use set to remove duplicates
+    xmhp = "XMHP" in calcs #if XMHP is included user eXcluisively wants MHP, so we don't return SA or LogP data.
+    mhp = "MHP" in calcs or xmhp
+    unrecognized = calcs - {"SA", "LOGP", "RG", "MV", "MHP", "XMHP"}
+    if len(unrecognized) > 0:
+        print(f"Unrecognized calculation(s): {unrecognized}. Use SA, LogP, MV, MHP, XMHP or Rg")
+    #(SA, LogP, Rg, MV, MHP, XMHP)
+    return ("SA" in calcs or mhp, "LOGP" in calcs or mhp, "RG" in calcs, "MV" in calcs, mhp, xmhp)
+
+def doCalcs(pol_iter, flags, defaults=built_in_settings):
     #pol_iter is an iterable that has several confs within.
-    #The type of variable /calcs/ is set
+    #flags come from getCalcFlags.
     #Calcs are only done if requested.
-    #remove entries from set after each calculation and print the unrecognized ones at the end.
+    need_sa, need_logp, need_rg, need_mv, need_mhp, exclusive = flags
     data = {}
-    if "SA" in calcs or "MHP" in calcs or "XMHP" in calcs:
+    if need_sa:
         sasa = Sasa(pol_iter)
-        if not "XMHP" in calcs: #if XMHP is included user eXcluisively wants MHP, so we don't return this data.
+        if not exclusive: #if XMHP is included user eXcluisively wants MHP, so we don't return this data.
             data["SA"] = sasa
-        calcs.discard("SA")
-    if "LOGP" in calcs or "MHP" in calcs or "XMHP" in calcs:
+    if need_logp:
         logP = LogP(pol_iter)
-        if not "XMHP" in calcs: #if XMHP is included user eXcluisively wants MHP, so we don't return this data.
+        if not exclusive:
             data["LogP"] = logP
-        calcs.discard("LOGP")
-    if "RG" in calcs:
-        rg = RadGyration(pol_iter)
-        data["Rg"] = rg
-        calcs.discard("RG")
-    if "MV" in calcs:
-        mv  =  MolVolume(pol_iter, box_margin=defaults["MV_boxMargin"], grid_spacing=defaults["MV_gridSpacing"])
-        data["MV"] = mv
-        calcs.discard("MV")
-    if "MHP" in calcs or "XMHP" in calcs:
-        mhp = logP / sasa
-        data["LogP/SA"] = mhp
-        calcs.discard("MHP")
-        calcs.discard("XMHP")
-    if len(calcs) > 0:
-        print(f"Unrecognized calculation(s): {calcs}. Use SA, LogP, MV, MHP, XMHP or Rg")
+    if need_rg:
+        data["Rg"] = RadGyration(pol_iter)
+    if need_mv:
+        data["MV"] = MolVolume(pol_iter, box_margin=defaults["MV_boxMargin"], grid_spacing=defaults["MV_gridSpacing"])
+    if need_mhp:
+        data["LogP/SA"] = logP / sasa
     return data
 
-def makePlot(pol_list, calculations, verbosity=False, data_marker='o', fig_filename="Size-dependent-stats.png"):
+def makePlot(pol_list, flags, verbosity=False, data_marker='o', fig_filename="Size-dependent-stats.png"):
     #creates a plot from the calcs of several polymers
     units = { "LogP/SA":"Angstroms^-2", "LogP":"", "Rg":"Angstroms", "SA":"Angstroms^2", "MV":"Molar Volume" }
-    dicts = []
+    data = {} #one list per column. Keys are added in the order they are first seen.
     for POL in pol_list:
-        calcs = set([calc.upper() for calc in calculations])
-        pol_data = doCalcs(POL.suppl, calcs)
+        pol_data = doCalcs(POL.suppl, flags)
         pol_data["N"] = POL.n * POL.mpn
         pol_data["smi"] = POL.smiles
         if POL.ratio is not None:
@@ -586,8 +622,8 @@ def makePlot(pol_list, calculations, verbosity=False, data_marker='o', fig_filen
             exclude = 3
         else:
             exclude = 2
-        dicts.append(pol_data)
-    data = {k: [d[k] for d in dicts] for k in dicts[0]} #merge dictionaries of data from all polymers into one sensible format.
+        for k, v in pol_data.items(): #add this polymer's data to the columns as we go.
+            data.setdefault(k, []).append(v)
     
     ncols = len(data) - exclude #we don't plot N, smiles nor ratios (if present).
 
@@ -643,12 +679,17 @@ def makePlot(pol_list, calculations, verbosity=False, data_marker='o', fig_filen
         plt.show()
     return df
 
-def exportToCSV(exptName, dataframe):
-    pandas.DataFrame.to_csv(dataframe, exptName, index=False)
+def exportData(exptName, dataframe):
+    if exptName.endswith(".jsonl"): #JSON Lines: one json object per row.
+        dataframe.to_json(exptName, orient="records", lines=True)
+    else:
+        pandas.DataFrame.to_csv(dataframe, exptName, index=False)
     print(f"Done exporting data to {exptName}.")
 
+exportToCSV = exportData #original name kept for scripts and notebooks that import it.
+
 def main(**kwargs):
-    default_dict = getStaticSettings()
+    static_settings = getStaticSettings()
     run_list = getArgs()
     
     #merge user-created smiles with built-in dicts and make accessible to all funcs
@@ -659,17 +700,33 @@ def main(**kwargs):
         for key in kwargs: 
             vardict[key] = kwargs[key] #assign all keyword arguments to proper place in var dictionary
 
+        #command-line or json arguments take precedence over the settings for this run only.
+        default_dict = dict(static_settings)
+        if vardict.get("num_confs") is not None:
+            default_dict["opt_numConfs"] = vardict["num_confs"]
+        if vardict.get("mmff_iters") is not None:
+            default_dict["opt_maxIters"] = vardict["mmff_iters"]
+        if vardict.get("no_cache"):
+            default_dict["opt_diskCache"] = False
+
+        #only embed and optimize if something needs 3D coordinates. LogP only needs the topology.
+        needs_3d = vardict["save"] is not None
+        if vardict["calculation"] is not None:
+            calc_flags = getCalcFlags(vardict["calculation"])
+            need_sa, _, need_rg, need_mv, _, _ = calc_flags #MHP requires SA so it is covered by need_sa.
+            needs_3d = needs_3d or need_sa or need_rg or need_mv
+
         if vardict["read"] is None: #then get polymer parameters from CLI arguments.
             repeat_unit = getRepeatUnit(vardict["single_monomer"], vardict["comonomer_sequence"])
             if not vardict["random"]:
                 if vardict["plot"]:
                     POL_LIST = make_One_or_More_Polymers(vardict["initiator"], vardict["n"],
-                        repeat_unit, vardict["terminator"], verbosity=vardict["verbose"], plot=vardict["plot"], confirm = not vardict["quiet"], defaults=default_dict)
+                        repeat_unit, vardict["terminator"], verbosity=vardict["verbose"], plot=vardict["plot"], confirm = not vardict["quiet"], needs_3d=needs_3d, defaults=default_dict)
                 else:
                     POL = make_One_or_More_Polymers(vardict["initiator"], vardict["n"],
-                        repeat_unit, vardict["terminator"], verbosity=vardict["verbose"], plot=vardict["plot"], confirm = not vardict["quiet"], defaults=default_dict)
+                        repeat_unit, vardict["terminator"], verbosity=vardict["verbose"], plot=vardict["plot"], confirm = not vardict["quiet"], needs_3d=needs_3d, defaults=default_dict)
             else:
-                if type(repeat_unit) != list:
+                if not isinstance(repeat_unit, list):
                     raise TypeError("comonomers must be specified with -b if -a is used.")
                 init, term = inator_smi_lookup(vardict["initiator"], vardict["terminator"])
                 init = validate_end_group(init, Init=True)
@@ -689,7 +746,7 @@ def main(**kwargs):
                         break
                     polSMILES = add_inator_smiles(polymer_body_smiles, init, term)
                     POL = Polymer(n, polSMILES, ratio=ratio)
-                    POL.suppl = optPol(POL.flat, nConfs=default_dict["opt_numConfs"], threads=default_dict["opt_numThreads"], iters=default_dict["opt_maxIters"])
+                    POL.suppl = optPolFromSettings(POL.smiles, default_dict, needs_3d=needs_3d)
                     if vardict["plot"]:
                         POL_LIST.append(POL)
 
@@ -733,8 +790,7 @@ def main(**kwargs):
             print(f'requested calculations are {vardict["calculation"]}')
         if vardict["calculation"] is not None:
             if not vardict["plot"]:
-                calcs = set([calc.upper() for calc in vardict["calculation"]])
-                data = doCalcs(POL.suppl, calcs, defaults=default_dict) #use set to remove duplicates
+                data = doCalcs(POL.suppl, calc_flags, defaults=default_dict)
                 data["N"] = vardict["n"] * POL.mpn
                 data["smi"] = POL.smiles
                 data = {k: [data[k]] for k in data} #values in dict need to be lists
@@ -742,14 +798,14 @@ def main(**kwargs):
                     data["Monomer Ratio"] = POL.ratio #already in list form 
                 dataframe = pandas.DataFrame(data)
             else:
-                dataframe = makePlot(POL_LIST, vardict["calculation"], 
+                dataframe = makePlot(POL_LIST, calc_flags, 
                     verbosity=vardict["verbose"], data_marker=default_dict["plot_dataPoint"], fig_filename=default_dict["plot_Filename"])
             
             #we should always show data if it is collected.
             print(dataframe)
 
             if vardict["export"] is not None:
-                exportToCSV(vardict["export"], dataframe)
+                exportData(vardict["export"], dataframe)
         elif vardict["calculation"] is None and vardict["export"] is not None:
             raise Exception("You cannot export data if none were collected.")
                 
@@ -17,7 +17,7 @@ notebook = {
    "metadata": {},
    "source": [
     "Available Keyword Arguments. More details on the github page.\\\n",
-    "{'n': 0, 'initiator': 'Hydrogen', 'terminator': 'Hydrogen', 'single_monomer': 'None', 'comonomer_sequence': None, 'draw': None, 'verbose': False, 'calculation': None, 'save': None, 'read': None, 'plot': False, 'export': None, 'json': None, 'quiet': False, 'random': False}\\\n",
+    "{'n': 0, 'initiator': 'Hydrogen', 'terminator': 'Hydrogen', 'single_monomer': 'None', 'comonomer_sequence': None, 'draw': None, 'verbose': False, 'calculation': None, 'save': None, 'read': None, 'plot': False, 'export': None, 'json': None, 'quiet': False, 'random': False, 'num_confs': None, 'mmff_iters': None, 'no_cache': False}\\\n",
     "\n",
     "Only one of single_monomer or comonomer_sequence can be specified at a time\\\n",
     "initiator, terminator and single_monomer can be dict keys from smiles.py or smiles that are formatted correctly (see github page)\\\n",
@@ -29,7 +29,9 @@ notebook = {
     "export is the name/path to a .csv file to which to export the data\\\n",
     "json is the name/path to a .json file which has parameters for several runs\\\n",
     "quiet suppesses the prompts to check proper connectivity of end groups\\\n",
-    "random allows comonomer_sequence to be interpreted as a desired ratio of comonomers randomly ordered rather than a repeating block.\\"
+    "random allows comonomer_sequence to be interpreted as a desired ratio of comonomers randomly ordered rather than a repeating block.\\\n",
+    "num_confs and mmff_iters override the number of conformations and optimization iterations from the settings for that run.\\\n",
+    "no_cache skips the on-disk cache of optimized conformers for that run.\\"
    ]
   },
   {
@@ -43,7 +45,6 @@ notebook = {
      "text": [
       "Polymer interpreted as: Hydrogen 3 * Styrene Hydrogen\n",
       "This gives the following SMILES: CC(c1ccccc1)CC(c1ccccc1)CC(c1ccccc1)\n",
-      "failed to remove tmp file.\n",
       "Saving image to polymer.png by default.\n",
       "requested calculations are ['XMHP', 'RG']\n",
       "         RG   LogP/SA  N                                   smi\n",
@@ -1,6 +1,6 @@
 import argparse, json, os
 
-default_dict = {"opt_numConfs":5, "opt_numThreads":0, "opt_maxIters":1500,
+default_dict = {"opt_numConfs":5, "opt_numThreads":0, "opt_maxIters":1500, "opt_randomSeed":61453, "opt_pruneRmsThresh":0.5, "opt_diskCache":True,
                 "drawing_subImgSize_edge":250, "drawing_default":"polymer.png", "MV_gridSpacing":0.2,
                 "MV_boxMargin" :2.0, "plot_dataPoint":"o", "plot_Filename":"Size-dependent-stats.png"}
 